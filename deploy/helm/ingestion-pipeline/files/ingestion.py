@@ -8,29 +8,119 @@ from kfp import compiler
         "boto3",
         "llama-stack-client==0.2.3", 
         "docling",
-        "docling-core"
+        "docling-core",
+        "pypdf",
+        "pypdfium2",
+        "msgpack"
     ])
-def fetch_from_minio_store_pgvector(llamastack_base_url: str):
+def fetch_from_minio_store_pgvector(
+    llamastack_base_url: str,
+    metrics: dsl.Output[dsl.Metrics],
+    num_workers: int = 0,
+    split_pdf_pages: int = 100,
+    concurrency: int = 16,
+    file_size_mb_threshold: int = 8,
+    insert_batch_size: int = 500,
+    cache_dir: str = "/tmp/rag-ingestion-cache",
+    local_embed: bool = False,
+    fast_load: bool = False,
+    pgvector_dsn: str = "",
+    cache_format: str = "msgpack",
+    document_cache_mb: int = 8192,
+    file_prefix: str = "",
+    max_files: int = 0,
+    file_extensions: str = ".pdf",
+    include_picture_images: bool = False,
+    do_ocr: bool = False,
+    pgvector_write_mode: str = "copy",
+    fast_text_extraction: bool = False,
+    enable_length_sort: bool = True,
+    reuse_cache: bool = True,
+    embed_batch_size: int = 256,
+    embed_batch_chars: int = 150_000,
+    store_dtype: str = "f16",
+    pin_workers: bool = False,
+):
     import shutil
     import os
+    import sys
+    import logging
+    import logging.handlers
     import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
     import tempfile    
+    import functools
+    import hashlib
+    import importlib.metadata
+    import io
+    import json
+    import math
+    import mmap
+    import msgpack
+    import multiprocessing
+    import queue
+    import re
+    import sqlite3
+    import subprocess
+    import threading
+    from concurrent.futures import (
+        FIRST_COMPLETED,
+        ProcessPoolExecutor,
+        ThreadPoolExecutor,
+        as_completed,
+        wait,
+    )
+    import pypdfium2
+    from pypdf import PdfReader, PdfWriter
     
+    # Log records from every thread and worker process go through a queue
+    # and are written by a single listener thread, so logging never blocks
+    # the download threads or the conversion workers on stdout
+    log_queue = multiprocessing.get_context("fork").Queue()
+    log_handler = logging.StreamHandler(sys.stdout)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(processName)s] %(message)s"))
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+    logger = logging.getLogger("ingestion")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener.start()
+
     temp_dir = tempfile.mkdtemp()
+    http_client = None
+    pg_conn = None
+    hash_db = None
 
     try: 
+        # fastembed (which pulls in ONNX Runtime) and psycopg are only used by
+        # the opt-in local_embed and fast_load paths, so they are installed
+        # here when those are on instead of on every run
+        optional_packages = []
+        if local_embed or fast_load:
+            optional_packages.append("fastembed")
+        if fast_load:
+            optional_packages.append("psycopg[binary]")
+        if optional_packages:
+            logger.info("Installing %s", ", ".join(optional_packages))
+            subprocess.run(
+                [sys.executable, "-m", "pip", "install", "--quiet", "--no-warn-script-location", *optional_packages],
+                check=True,
+            )
+
         # Set EasyOCR path to a writeable directory BEFORE importing docling
         # It runs fine without it in the local environment, but fails in the pipeline container
         os.environ["EASYOCR_MODULE_PATH"] = "/tmp/.EasyOCR"
 
+        import httpx
         from llama_stack_client import LlamaStackClient
-        from llama_stack_client.types import Document as LlamaStackDocument
         
         # Import docling libraries
         from docling.document_converter import DocumentConverter, PdfFormatOption
-        from docling.datamodel.base_models import InputFormat
-        from docling.datamodel.pipeline_options import PdfPipelineOptions
+        from docling.datamodel.base_models import DocumentStream, InputFormat
+        from docling.datamodel.pipeline_options import AcceleratorOptions, PdfPipelineOptions
         from docling_core.transforms.chunker.hybrid_chunker import HybridChunker
+        from docling_core.types.doc import DoclingDocument
         from docling_core.types.doc.labels import DocItemLabel
 
         source = os.environ.get('SOURCE')
@@ -48,102 +138,570 @@ def fetch_from_minio_store_pgvector(llamastack_base_url: str):
         region_name = os.environ.get('REGION')
 
         # Step 1: Download files from MinIO
-        temp_dir = tempfile.mkdtemp()
+        # temp_dir is fresh, so the download directory cannot exist yet
         download_dir = os.path.join(temp_dir, "source_repo")
-        os.makedirs(download_dir, exist_ok=True)
+        os.mkdir(download_dir)
+
+        # Every download thread can have part_concurrency ranged GETs in
+        # flight; botocore keeps only 10 connections by default and reopens
+        # a new one for every request past that
+        part_concurrency = 10
 
         # Connect to MinIO
-        print(f"Connecting to MinIO at {minio_endpoint}")
+        logger.info("Connecting to MinIO at %s", minio_endpoint)
         s3 = boto3.client(
             "s3",
             endpoint_url=minio_endpoint,
             aws_access_key_id=minio_access_key,
             aws_secret_access_key=minio_secret_key,
-            verify=False
+            verify=False,
+            config=Config(max_pool_connections=concurrency * part_concurrency),
         )
 
         # List and download objects
         paginator = s3.get_paginator("list_objects_v2")
-        pages = paginator.paginate(Bucket=bucket_name)
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=file_prefix,
+            PaginationConfig={"PageSize": 1000},
+        )
+
+        # Lowercased once so each key needs a single endswith call
+        extensions = tuple(ext.strip().lower() for ext in file_extensions.split(",") if ext.strip())
 
-        print(f"Downloading files from bucket: {bucket_name}")
-        downloaded_files = []
+        objects_to_fetch = []
         for page in pages:
             for obj in page.get("Contents", []):
                 key = obj["Key"]
-                file_path = os.path.join(download_dir, os.path.basename(key))
-                print(f"Downloading: {key} -> {file_path}")
-                s3.download_file(bucket_name, key, file_path)
-                downloaded_files.append(file_path)
-        
-        print(f"Downloaded {len(downloaded_files)} files to {download_dir}")
-        
-        if not downloaded_files:
-            raise Exception(f"No files found in bucket: {bucket_name}. Please check your bucket configuration.")
-        
-        # Step 2: Process the PDFs with docling
-        # Setup docling components
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.generate_picture_images = True
-        converter = DocumentConverter(
-                    format_options={
-                        InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-                    }
+                # Skip empty files
+                if obj["Size"] == 0:
+                    logger.info("Skipping empty file: %s (0 bytes)", key)
+                    continue
+
+                if not key.lower().endswith(extensions):
+                    logger.info("Skipping file: %s (unsupported file type)", key)
+                    continue
+
+                objects_to_fetch.append((key, obj["Size"]))
+
+            # Pages are fetched lazily, so stopping here saves the remaining
+            # LIST requests on large buckets
+            if max_files and len(objects_to_fetch) >= max_files:
+                objects_to_fetch = objects_to_fetch[:max_files]
+                break
+
+        # Large objects are also fetched as parallel 8 MB byte ranges, so a
+        # single big PDF does not serialize on one GET
+        transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=part_concurrency,
+            use_threads=True,
         )
-        chunker = HybridChunker()
-        llama_documents = []
-        i = 0
-        
-        # Process each file with docling (chunking)
-        for file_path in downloaded_files:
-            # Skip empty files
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                print(f"Skipping empty file: {file_path} (0 bytes)")
-                continue
-
-            if not file_path.endswith(".pdf"):
-                print(f"Skipping non-PDF file: {file_path} (unsupported file type)")
-                continue
-
-            print(f"Processing {file_path} with docling...")
+        inline_threshold = file_size_mb_threshold * 1024 * 1024
+
+        def _download(doc_index, key, size):
+            # Small objects are kept in memory and handed to docling as a
+            # stream; only large ones go through a temporary file
+            name = os.path.basename(key)
+            if size <= inline_threshold:
+                logger.info("Downloading: %s -> memory", key)
+                content = s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+                return {"name": name, "content": content, "sha256": hashlib.sha256(content).hexdigest()}
+            # Keys under different prefixes can share a basename, the index
+            # keeps their local files apart
+            file_path = os.path.join(download_dir, f"{doc_index:06d}-{name}")
+            logger.info("Downloading: %s -> %s", key, file_path)
+            s3.download_file(bucket_name, key, file_path, Config=transfer_config)
+            # Hashed through a read-only mapping instead of reading the file
+            # into memory
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                sha256 = hashlib.sha256(mapped).hexdigest()
+            return {"name": name, "file_path": file_path, "sha256": sha256}
+
+        if not objects_to_fetch:
+            raise Exception(f"No files found in bucket: {bucket_name}. Please check your bucket configuration.")
+
+        # Step 2: Process the documents with docling
+        # Conversion and chunking run in a pool of worker processes, and only
+        # the chunk texts are sent back to this process.
+        # KFP only ships the body of this function, so the worker functions are
+        # declared global to make them picklable for the pool.
+        global _get_converter, _convert_and_chunk
+
+        # Picture images are only rendered when asked for: only chunk text is
+        # indexed, and rendering and base64-encoding every picture is costly.
+        # OCR is also off by default, it is only needed for scanned PDFs and
+        # is by far the slowest part of the docling pipeline.
+        # docling-core is not pinned, so its version is part of the options
+        # the document cache is keyed by: entries written with another schema
+        # are never read back
+        conversion_options = {
+            "include_picture_images": include_picture_images,
+            "docling_core": importlib.metadata.version("docling-core"),
+        }
+
+        # The docling components load their models when built, so they are
+        # built once per process and reused for every file
+        @functools.lru_cache(maxsize=2)
+        def _get_converter(ocr):
+            # Setup docling components
+            pipeline_options = PdfPipelineOptions()
+            pipeline_options.generate_picture_images = include_picture_images
+            pipeline_options.do_ocr = ocr
+            # Every worker runs its own models, so each one only gets its
+            # share of the CPUs instead of docling's default thread count
+            pipeline_options.accelerator_options = AcceleratorOptions(num_threads=threads_per_worker)
+            return DocumentConverter(
+                        format_options={
+                            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+                        }
+            )
+
+        @functools.lru_cache(maxsize=1)
+        def _get_chunker():
+            return HybridChunker()
+
+        # Only body text is indexed
+        keep_labels = frozenset({DocItemLabel.TEXT, DocItemLabel.PARAGRAPH})
+
+        def _detect_pdf_type(pdf_source, sample_pages=5, min_chars=32):
+            # A PDF is text-native when at least 80% of its first pages have
+            # an extractable text layer, otherwise it needs OCR
+            pdf = pypdfium2.PdfDocument(pdf_source)
             try:
-                docling_doc = converter.convert(source=file_path).document
-                chunks = chunker.chunk(docling_doc)
-                chunk_count = 0
-
-                for chunk in chunks:
-                    if any(
-                        c.label in [DocItemLabel.TEXT, DocItemLabel.PARAGRAPH]
-                        for c in chunk.meta.doc_items
-                    ):
-                        i += 1
-                        chunk_count += 1
-                        llama_documents.append(
-                            LlamaStackDocument(
-                                document_id=f"doc-{i}",
-                                content=chunk.text,
-                                mime_type="text/plain",
-                                metadata={"source": os.path.basename(file_path)},
-                            )
-                        )
-                
-                print(f"Created {chunk_count} chunks from {file_path}")
-                
+                sampled = min(sample_pages, len(pdf))
+                text_pages = sum(
+                    len(pdf[i].get_textpage().get_text_range().strip()) >= min_chars
+                    for i in range(sampled)
+                )
+            finally:
+                pdf.close()
+            return "text" if not sampled or text_pages / sampled >= 0.8 else "scanned"
+
+        def _page_lines(page):
+            # pdfium only marks line ends, so lines are rebuilt from the
+            # positions of the text runs: runs of the same column whose
+            # vertical centers fall inside the same band share a line. Lines
+            # are returned in reading order, column by column, as
+            # (top, bottom, text) in PDF coordinates, origin at the bottom
+            textpage = page.get_textpage()
+            runs = []
+            for i in range(textpage.count_rects()):
+                left, bottom, right, top = textpage.get_rect(i)
+                # pdfium reports a hyphen at a line break as \x02
+                text = " ".join(textpage.get_text_bounded(left, bottom, right, top).replace("\x02", "-").split())
+                if text:
+                    runs.append((left, bottom, right, top, text))
+            if not runs:
+                return []
+
+            # Columns are split at gutters: strips at least 8pt wide that
+            # hardly any run narrower than half the text crosses, with a fifth
+            # of the covered width or more on either side. Wide runs, like
+            # titles over both columns, are left out so they cannot hide a
+            # gutter, and a bullet or a short last column still counts
+            origin = int(min(run[0] for run in runs))
+            extent = max(run[2] for run in runs) - origin
+            coverage = [0] * (int(extent) + 2)
+            for left, _, right, _, _ in runs:
+                if right - left < extent / 2:
+                    coverage[int(left) - origin] += 1
+                    coverage[int(right) - origin + 1] -= 1
+            for x in range(1, len(coverage)):
+                coverage[x] += coverage[x - 1]
+            sparse = 0.02 * max(coverage)
+            covered_width = sum(amount > sparse for amount in coverage)
+            gutters = []
+            gutter_start = None
+            covered = 0
+            for x, amount in enumerate(coverage):
+                if amount <= sparse:
+                    if gutter_start is None:
+                        gutter_start, covered_before = x, covered
+                    continue
+                if gutter_start is not None:
+                    if x - gutter_start >= 8 and min(covered_before, covered_width - covered) >= 0.2 * covered_width:
+                        gutters.append(origin + (gutter_start + x) / 2)
+                    gutter_start = None
+                covered += 1
+
+            # Runs that cross a gutter span the page and are kept in their
+            # own lines (column None)
+            lines = []
+            last_line = {}
+            for left, bottom, right, top, text in sorted(runs, key=lambda run: (-run[3], run[0])):
+                column = None if any(left < gutter < right for gutter in gutters) else sum(gutter <= left for gutter in gutters)
+                index = last_line.get(column)
+                if index is not None and lines[index][1] <= (top + bottom) / 2 <= lines[index][0]:
+                    line_top, line_bottom, _, line_runs = lines[index]
+                    lines[index] = (max(line_top, top), min(line_bottom, bottom), column, line_runs + [(left, text)])
+                else:
+                    last_line[column] = len(lines)
+                    lines.append((top, bottom, column, [(left, text)]))
+
+            # Between spanning lines the columns are read one after the other
+            ordered = []
+            section = []
+            for line in lines + [(None, None, None, None)]:
+                if line[2] is None:
+                    ordered += sorted(section, key=lambda section_line: section_line[2])
+                    ordered.append(line)
+                    section = []
+                else:
+                    section.append(line)
+            return [
+                (top, bottom, " ".join(text for _, text in sorted(line_runs)))
+                for top, bottom, _, line_runs in ordered[:-1]
+            ]
+
+        page_number_line = re.compile(r"(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?", re.IGNORECASE)
+
+        def _extract_text_document(name, pdf_source):
+            # Text-native PDFs skip the layout and OCR models. Lines are read
+            # from pdfium's text layer, running headers and footers are
+            # dropped, and the rest is grouped into paragraphs on vertical gaps
+            pdf = pypdfium2.PdfDocument(pdf_source)
+            try:
+                pages = [(page.get_height(), _page_lines(page)) for page in pdf]
+            finally:
+                pdf.close()
+
+            # A header or footer is a line in the top or bottom tenth of the
+            # page that comes back on at least half of the pages, with the
+            # digits ignored so "Page 3 of 10" matches across pages. Page
+            # numbers in the margins are dropped even when they do not repeat
+            def _margin_key(height, top, bottom, text):
+                if bottom > 0.9 * height or top < 0.1 * height:
+                    return re.sub(r"\d+", "#", text.lower())
+                return None
+
+            margin_counts = {}
+            for height, lines in pages:
+                for key in {_margin_key(height, *line) for line in lines} - {None}:
+                    margin_counts[key] = margin_counts.get(key, 0) + 1
+            repeated = {
+                key for key, count in margin_counts.items()
+                if len(pages) >= 3 and count >= len(pages) / 2
+            }
+
+            doc = DoclingDocument(name=name)
+            for height, lines in pages:
+                kept = []
+                for line in lines:
+                    key = _margin_key(height, *line)
+                    if key is None or (key not in repeated and not page_number_line.fullmatch(line[2])):
+                        kept.append(line)
+                lines = kept
+                if not lines:
+                    continue
+                # A paragraph ends where the gap to the next line is clearly
+                # larger than the usual spacing between lines on the page, and
+                # where the text moves up to the top of the next column
+                gaps = sorted(
+                    max(0.0, above[1] - below[0]) for above, below in zip(lines, lines[1:]) if below[0] <= above[0]
+                )
+                heights = sorted(top - bottom for top, bottom, _ in lines)
+                split_gap = (gaps[(len(gaps) - 1) // 2] if gaps else 0.0) + 0.5 * heights[len(heights) // 2]
+                paragraph = lines[0][2]
+                for above, below in zip(lines, lines[1:]):
+                    if above[1] - below[0] > split_gap or below[0] > above[0]:
+                        doc.add_text(label=DocItemLabel.PARAGRAPH, text=paragraph)
+                        paragraph = below[2]
+                    elif re.search(r"[^\W\d]-$", paragraph):
+                        # Words hyphenated over a line break are joined again
+                        paragraph = paragraph[:-1] + below[2]
+                    else:
+                        paragraph += " " + below[2]
+                doc.add_text(label=DocItemLabel.PARAGRAPH, text=paragraph)
+            return doc
+
+        def _convert_one(document, use_cache=True):
+            # Files on disk are opened by path, pdfium and docling read them
+            # without a copy of the whole file in memory
+            if "content" in document:
+                pdf_source = document["content"]
+                source = DocumentStream(name=document["name"], stream=io.BytesIO(pdf_source))
+            else:
+                pdf_source = source = document["file_path"]
+
+            # PDFs are routed by their text layer: text-native ones can take
+            # the fast path, scanned ones always go through docling with OCR
+            ocr = do_ocr
+            if document["name"].lower().endswith(".pdf"):
+                pdf_type = _detect_pdf_type(pdf_source)
+                if pdf_type == "text" and fast_text_extraction:
+                    logger.info("%s: text PDF, extracting with pypdfium2", document["name"])
+                    return _extract_text_document(document["name"], pdf_source), False
+                ocr = ocr or pdf_type == "scanned"
+                logger.info("%s: %s PDF, converting with docling (OCR %s)",
+                            document["name"], pdf_type, "on" if ocr else "off")
+
+            # Parsed documents are cached by content, so unchanged PDFs are not
+            # parsed again when the pipeline is rerun. msgpack entries are
+            # several times smaller and faster to load than JSON, which is
+            # still read and can be written with cache_format="json".
+            # The cache only saves work: an entry that cannot be read is a
+            # miss and a failed write is logged, neither fails the document.
+            cache_path = None
+            if cache_dir:
+                # Whole documents are keyed by the SHA-256 taken while they
+                # were downloaded, shards by that hash and their page range,
+                # so nothing is hashed twice. Documents converted with other
+                # options are cached separately
+                cache_key = document["cache_key"] if "cache_key" in document else document["sha256"]
+                options = json.dumps({**conversion_options, "do_ocr": ocr}, sort_keys=True)
+                cache_path = os.path.join(cache_dir, "documents", hashlib.blake2b(f"{cache_key}:{options}".encode()).hexdigest())
+                if use_cache:
+                    for extension in ("msgpack", "json"):
+                        entry_path = f"{cache_path}.{extension}"
+                        if not os.path.exists(entry_path):
+                            continue
+                        try:
+                            with open(entry_path, "rb") as f:
+                                data = f.read()
+                            if extension == "msgpack":
+                                cached_doc = DoclingDocument.model_validate(msgpack.unpackb(data, raw=False))
+                            else:
+                                cached_doc = DoclingDocument.model_validate_json(data)
+                            # The modification time records the last use, the
+                            # cache is trimmed least recently used first
+                            os.utime(entry_path)
+                            return cached_doc, True
+                        except Exception as e:
+                            logger.warning("Ignoring unreadable cache entry for %s: %s", document["name"], e)
+
+            docling_doc = _get_converter(ocr).convert(source=source).document
+            if cache_path:
+                if cache_format == "json":
+                    cache_path = f"{cache_path}.json"
+                    payload = docling_doc.model_dump_json().encode()
+                else:
+                    cache_path = f"{cache_path}.msgpack"
+                    payload = msgpack.packb(docling_doc.model_dump(mode="json"), use_bin_type=True)
+                # Write then rename so concurrent workers never read a partial file
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                try:
+                    with open(tmp_path, "wb") as f:
+                        f.write(payload)
+                    os.replace(tmp_path, cache_path)
+                except OSError as e:
+                    logger.warning("Could not cache the conversion of %s: %s", document["name"], e)
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+            return docling_doc, False
+
+        def _convert_and_chunk(document):
+            docling_doc, cached = _convert_one(document)
+            try:
+                chunks = list(_get_chunker().chunk(docling_doc))
             except Exception as e:
-                error_message = str(e)
-                print(f"Error processing {file_path}: {error_message}")
+                if not cached:
+                    raise
+                # An entry can load and still not chunk, e.g. after a schema
+                # change the version key does not catch; convert it again
+                logger.warning("Cached conversion of %s could not be chunked, converting again: %s", document["name"], e)
+                chunks = list(_get_chunker().chunk(_convert_one(document, use_cache=False)[0]))
+            # isdisjoint does the membership loop in C and stops at the first hit
+            return [
+                chunk.text
+                for chunk in chunks
+                if not keep_labels.isdisjoint(c.label for c in chunk.meta.doc_items)
+            ]
 
-        total_chunks = len(llama_documents)
-        print(f"Total valid chunks prepared: {total_chunks}")
+        def _page_count(document):
+            # pdfium reads files on disk in place, pypdf would copy the whole
+            # file onto the heap just to count its pages
+            pdf = pypdfium2.PdfDocument(document["content"] if "content" in document else document["file_path"])
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
 
-        # Add error handling for zero chunks
-        if total_chunks == 0:
-            raise Exception("No valid chunks were created. Check document processing errors above.")
+        def _pages_per_shard(page_count):
+            # Two shards per worker keep every worker busy while a shard
+            # finishes unevenly; more would only add docling startup costs
+            # and chunk boundaries, since shards are chunked separately
+            return max(5, math.ceil(page_count / (2 * workers)))
+
+        def _split_pdf(document, reader, pages_per_shard):
+            # Shards stay in the same form (memory or file) as their document
+            stem = os.path.splitext(document["name"])[0]
+            shards = []
+            for start in range(0, len(reader.pages), pages_per_shard):
+                writer = PdfWriter()
+                for page in reader.pages[start:start + pages_per_shard]:
+                    writer.add_page(page)
+                shard = {
+                    "name": f"{stem}.part{len(shards):04d}.pdf",
+                    "cache_key": f"{document['sha256']}.pages{start + 1}-{min(start + pages_per_shard, len(reader.pages))}",
+                }
+                if "content" in document:
+                    buffer = io.BytesIO()
+                    writer.write(buffer)
+                    shard["content"] = buffer.getvalue()
+                else:
+                    # Named after the document's own (unique) local file
+                    shard["file_path"] = f"{os.path.splitext(document['file_path'])[0]}.part{len(shards):04d}.pdf"
+                    with open(shard["file_path"], "wb") as f:
+                        writer.write(f)
+                shards.append(shard)
+            return shards
+
+        def _available_cpus():
+            # os.cpu_count() reports the node's cores, not the pod's share;
+            # honour the affinity mask and the cgroup CPU quota instead, v2
+            # first and v1 on older nodes
+            cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+            try:
+                with open("/sys/fs/cgroup/cpu.max") as f:
+                    quota, period = f.read().split()
+            except (OSError, ValueError):
+                try:
+                    with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                        quota = f.read().strip()
+                    with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                        period = f.read().strip()
+                except OSError:
+                    return cpus
+            try:
+                if quota not in ("max", "-1"):
+                    cpus = min(cpus, max(1, int(quota) // int(period)))
+            except ValueError:
+                pass
+            return cpus
+
+        processing_metrics = {"failed_documents": []}
+
+        # Downloads and conversions overlap: a downloader thread feeds a
+        # queue that the conversion pool drains, so network time is hidden
+        # behind docling's CPU time
+        cpus = _available_cpus()
+        workers = num_workers or cpus
+        threads_per_worker = max(1, cpus // workers)
+        download_queue = queue.Queue()
+        # A slot is taken before each download starts and only given back
+        # when the main thread picks the document up, so downloads run at
+        # most this many documents ahead of the conversions instead of
+        # pulling the whole bucket into memory and onto disk
+        download_slots = threading.Semaphore(max(concurrency, 2 * workers))
+
+        def _fetch(doc_index, key, size):
+            try:
+                download_queue.put((doc_index, _download(doc_index, key, size)))
+            except Exception as e:
+                logger.warning("Skipping %s, download failed: %s", key, e)
+                download_slots.release()
+
+        def _download_all():
+            try:
+                # boto3 clients are thread-safe, so the downloads share one client
+                with ThreadPoolExecutor(max_workers=concurrency) as download_pool:
+                    for doc_index, (key, size) in enumerate(objects_to_fetch):
+                        download_slots.acquire()
+                        download_pool.submit(_fetch, doc_index, key, size)
+            finally:
+                # Signal the end of the downloads
+                download_queue.put(None)
+
+        def _shard(document):
+            # Large PDFs are converted as page-range shards so that a single
+            # document can use every worker
+            if split_pdf_pages <= 0 or not document["name"].lower().endswith(".pdf"):
+                return [document]
+            try:
+                page_count = _page_count(document)
+                if page_count > split_pdf_pages:
+                    # Only documents that are split are opened with pypdf, and
+                    # from a stream so files on disk are read as pages are copied
+                    with (io.BytesIO(document["content"]) if "content" in document
+                          else open(document["file_path"], "rb")) as stream:
+                        document_shards = _split_pdf(document, PdfReader(stream), _pages_per_shard(page_count))
+                    logger.info("Split %s (%d pages) into %d shards", document["name"], page_count, len(document_shards))
+                    return document_shards
+            except Exception as e:
+                logger.warning("Could not split %s, converting it whole: %s", document["name"], e)
+            return [document]
+
+        # Chunks that were already stored in this vector DB by an earlier run
+        # are skipped, so re-ingesting an updated PDF only embeds what changed.
+        # Mount a volume at cache_dir to keep the hashes between pipeline runs.
+        stored_hashes = set()
+        stored_files = set()
+
+        def _trim_document_cache():
+            # Converted documents are evicted least recently used first once
+            # they outgrow document_cache_mb (0 keeps everything), so the
+            # cache volume never fills up. Temporary files left behind by an
+            # interrupted write are always removed
+            entries = []
+            for entry in os.scandir(os.path.join(cache_dir, "documents")):
+                try:
+                    if entry.name.endswith(".tmp"):
+                        os.remove(entry.path)
+                    else:
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    pass
+            cache_size = sum(size for _, size, _ in entries)
+            budget = document_cache_mb * 1024 * 1024
+            evicted = 0
+            for _, size, path in sorted(entries):
+                if document_cache_mb <= 0 or cache_size <= budget:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                cache_size -= size
+                evicted += 1
+            if evicted:
+                logger.info("Evicted %d converted documents from the cache (%d MB left)",
+                            evicted, cache_size // (1024 * 1024))
+
+        if cache_dir:
+            # Created once here rather than before every cache write
+            os.makedirs(os.path.join(cache_dir, "documents"), exist_ok=True)
+            _trim_document_cache()
+            # Read here, written by the insert thread once batches are stored
+            hash_db = sqlite3.connect(
+                os.path.join(cache_dir, "chunk_hashes.sqlite"), check_same_thread=False
+            )
+            hash_db.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_hashes ("
+                "vector_db_id TEXT, sha256 TEXT, PRIMARY KEY (vector_db_id, sha256))"
+            )
+            stored_hashes = {
+                row[0] for row in hash_db.execute(
+                    "SELECT sha256 FROM chunk_hashes WHERE vector_db_id = ?", (vector_db_name,)
+                )
+            }
+            # Whole files that were fully ingested before are skipped before
+            # conversion; reuse_cache=False reprocesses them anyway
+            hash_db.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                "vector_db_id TEXT, sha256 TEXT, chunk_ids TEXT, PRIMARY KEY (vector_db_id, sha256))"
+            )
+            if reuse_cache:
+                stored_files = {
+                    row[0] for row in hash_db.execute(
+                        "SELECT sha256 FROM file_hashes WHERE vector_db_id = ?", (vector_db_name,)
+                    )
+                }
 
         # Step 3: Register vector database and store chunks with embeddings
-        client = LlamaStackClient(base_url=llamastack_base_url)
-        print("Registering db")
+        # One pooled HTTP client for every llama-stack call, with keep-alive
+        # connections for the inserts and a timeout long enough for the
+        # server to embed a full batch
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+            timeout=httpx.Timeout(300.0, connect=10.0),
+        )
+        client = LlamaStackClient(base_url=llamastack_base_url, http_client=http_client)
+        logger.info("Registering db")
         try:
             client.vector_dbs.register(
                 vector_db_id=vector_db_name,
@@ -151,31 +709,493 @@ def fetch_from_minio_store_pgvector(llamastack_base_url: str):
                 embedding_dimension=384,
                 provider_id="pgvector",
             )
-            print("Vector DB registered successfully")
+            logger.info("Vector DB registered successfully")
         except Exception as e:
             error_message = str(e)
-            print(f"Failed to register vector DB: {error_message}")
-            print("Continuing with insertion...")
+            logger.warning("Failed to register vector DB: %s", error_message)
+            logger.info("Continuing with insertion...")
 
-        try:
-            print(f"Inserting {total_chunks} chunks into vector database")
-            client.tool_runtime.rag_tool.insert(
-                documents=llama_documents,
-                vector_db_id=vector_db_name,
-                chunk_size_in_tokens=512,
+        # With local_embed the chunks are embedded here with fastembed (ONNX
+        # Runtime) and sent with their vectors, instead of having the server
+        # embed every chunk. The llama-stack server must accept precomputed
+        # chunk embeddings.
+        @functools.lru_cache(maxsize=1)
+        def _get_embedder():
+            from fastembed import TextEmbedding
+
+            logger.info("Embedding chunks locally with %s", embedding_model)
+            return TextEmbedding(
+                model_name=embedding_model if "/" in embedding_model
+                else f"sentence-transformers/{embedding_model}"
             )
-            print("Documents successfully inserted into the vector DB")
 
-        except Exception as e:
-            print("Embedding insert failed:", e)
-            raise Exception(f"Failed to insert documents into vector DB: {e}")
+        processing_metrics["embed_fallbacks"] = 0
+
+        def _embed_batches(texts):
+            # A batch is closed by whichever limit trips first, so batches of
+            # long chunks stay small and short ones can be packed densely
+            batch, batch_chars = [], 0
+            for text in texts:
+                if batch and (len(batch) >= embed_batch_size or batch_chars + len(text) > embed_batch_chars):
+                    yield batch
+                    batch, batch_chars = [], 0
+                batch.append(text)
+                batch_chars += len(text)
+            if batch:
+                yield batch
+
+        def _embed(texts):
+            import numpy as np
+
+            # Embedding batches are padded to their longest text, so grouping
+            # texts of similar length wastes less of each forward pass; the
+            # vectors are put back in the original order afterwards
+            order = range(len(texts))
+            if enable_length_sort:
+                order = sorted(order, key=lambda i: len(texts[i]))
+            embedder = _get_embedder()
+            vectors = []
+            for batch in _embed_batches([texts[i] for i in order]):
+                try:
+                    vectors.extend(list(embedder.embed(batch, batch_size=len(batch))))
+                except Exception as e:
+                    # A batch that does not fit in memory is retried one text
+                    # at a time instead of failing the whole insert batch
+                    logger.warning("Embedding %d texts failed, retrying one at a time: %s", len(batch), e)
+                    processing_metrics["embed_fallbacks"] += 1
+                    for text in batch:
+                        vectors.extend(embedder.embed([text], batch_size=1))
+            # One array for the whole batch: the scatter back into the
+            # original order and the conversion to lists are single calls
+            # instead of a Python loop and a tolist() per vector
+            embeddings = np.empty((len(texts), len(vectors[0])), dtype=np.float32)
+            embeddings[list(order)] = np.stack(vectors)
+            return embeddings
+
+        def _as_store_dtype(embeddings):
+            # With store_dtype="f16" the values are rounded to half precision
+            # and written out as their shortest decimal form, which is less
+            # than half the size of the float32 digits and loses nothing
+            # retrieval can measure. pgvector still stores them as float32.
+            if store_dtype == "f32":
+                return embeddings.astype(str)
+            return embeddings.astype("float16").astype(str)
+
+        # With fast_load the embedded chunks are streamed straight into the
+        # llama-stack pgvector table with COPY, skipping the per-row inserts
+        # done by the server
+        # The provider creates the table with an unquoted name, which
+        # postgres folds to lower case
+        pg_table = ("vector_store_" + vector_db_name.replace("-", "_")).lower()
+        if fast_load:
+            dsn = pgvector_dsn or os.environ.get("PGVECTOR_DSN", "")
+            if dsn:
+                import psycopg
+                from psycopg import sql
+
+                # The table name comes from the vector DB id, so it is quoted
+                # as an identifier instead of being pasted into the statements.
+                # COPY is the fastest way to append new rows. Chunk ids are
+                # stable, so rows can already be there when the hash cache is
+                # missing: they are copied into a temporary table first and
+                # moved over skipping existing ids. "upsert" mode overwrites
+                # rows that are already there instead, like the provider does
+                staging_sql = sql.SQL(
+                    "CREATE TEMP TABLE ingestion_rows (LIKE {} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                ).format(sql.Identifier(pg_table))
+                copy_sql = sql.SQL("COPY ingestion_rows (id, document, embedding) FROM STDIN")
+                append_sql = sql.SQL(
+                    "INSERT INTO {} (id, document, embedding) SELECT id, document, embedding FROM ingestion_rows "
+                    "ON CONFLICT (id) DO NOTHING"
+                ).format(sql.Identifier(pg_table))
+                upsert_sql = sql.SQL(
+                    "INSERT INTO {} (id, document, embedding) VALUES (%s, %s::jsonb, %s::vector) "
+                    "ON CONFLICT (id) DO UPDATE SET embedding = EXCLUDED.embedding, document = EXCLUDED.document"
+                ).format(sql.Identifier(pg_table))
+                pg_conn = psycopg.connect(dsn)
+                if pgvector_write_mode != "upsert":
+                    # Emptied by every commit, so it only ever holds one batch
+                    pg_conn.execute(staging_sql)
+                    pg_conn.commit()
+                logger.info("Loading chunks directly into %s", pg_table)
+            else:
+                logger.warning("No pgvector connection info (pgvector_dsn or PGVECTOR_DSN), "
+                               "falling back to the llama-stack insert")
+
+        def _embed_batch(batch_texts):
+            # Vectors in the form their write path sends them, or None when
+            # the llama-stack server embeds the chunks itself
+            if pg_conn is not None:
+                return _as_store_dtype(_embed(batch_texts))
+            if local_embed or fast_load:
+                return _as_store_dtype(_embed(batch_texts)).astype("float64").tolist()
+            return None
+
+        def _insert_batch(batch_ids, batch_texts, batch_sources, embeddings):
+            # Plain dicts match the SDK's request params, so they are sent
+            # as is instead of being validated and dumped per document
+            if pg_conn is not None:
+                # Same row layout as the llama-stack pgvector provider
+                rows = [
+                    (
+                        f"{document_id}:chunk-0",
+                        json.dumps({
+                            "content": text,
+                            "metadata": {"document_id": document_id, "source": source},
+                        }),
+                        "[" + ",".join(embedding) + "]",
+                    )
+                    for document_id, text, source, embedding in zip(
+                        batch_ids, batch_texts, batch_sources, embeddings
+                    )
+                ]
+                with pg_conn.cursor() as cur:
+                    if pgvector_write_mode == "upsert":
+                        # Pipeline mode sends every statement of the batch
+                        # without waiting for each reply in turn
+                        with pg_conn.pipeline():
+                            cur.executemany(upsert_sql, rows)
+                    else:
+                        with cur.copy(copy_sql) as copy:
+                            for row in rows:
+                                copy.write_row(row)
+                        cur.execute(append_sql)
+                pg_conn.commit()
+            elif embeddings is not None:
+                client.vector_io.insert(
+                    vector_db_id=vector_db_name,
+                    chunks=[
+                        {
+                            "content": text,
+                            "metadata": {"document_id": document_id, "source": source},
+                            "embedding": embedding,
+                        }
+                        for document_id, text, source, embedding in zip(
+                            batch_ids, batch_texts, batch_sources, embeddings
+                        )
+                    ],
+                )
+            else:
+                client.tool_runtime.rag_tool.insert(
+                    documents=[
+                        {
+                            "document_id": document_id,
+                            "content": text,
+                            "mime_type": "text/plain",
+                            "metadata": {"source": source},
+                        }
+                        for document_id, text, source in zip(batch_ids, batch_texts, batch_sources)
+                    ],
+                    vector_db_id=vector_db_name,
+                    chunk_size_in_tokens=512,
+                )
+
+        # Inserts run on their own thread, fed through a small bounded queue,
+        # so embedding and storing one batch overlaps with converting the next
+        # documents. Batches stay bounded so the server never has to embed and
+        # hold the whole corpus in a single request.
+        insert_queue = queue.Queue(maxsize=4)
+        processing_metrics["inserted_chunks"] = 0
+        processing_metrics["failed_batches"] = 0
+
+        # When chunks are embedded locally, embedding and writing are split
+        # over two threads joined by a few ready batches, so the next batch
+        # is already being embedded while the previous one is being written
+        ready_batches = queue.Queue(maxsize=4)
+
+        def _put(target_queue, item, consumer):
+            # A plain put would block forever once the thread draining the
+            # queue has died, so keep checking that it is still there
+            while True:
+                try:
+                    target_queue.put(item, timeout=5)
+                    return
+                except queue.Full:
+                    if not consumer.is_alive():
+                        raise RuntimeError("The insert threads stopped before all chunks were stored")
+
+        def _embed_all():
+            try:
+                while (batch := insert_queue.get()) is not None:
+                    try:
+                        _put(ready_batches, (batch, _embed_batch(batch[1]), None), insert_thread)
+                    except Exception as e:
+                        # Failures are reported by the insert thread, which
+                        # keeps the batch counts in one place
+                        _put(ready_batches, (batch, None, e), insert_thread)
+            finally:
+                _put(ready_batches, None, insert_thread)
+
+        def _insert_all():
+            while (item := ready_batches.get()) is not None:
+                # Chunks are kept as parallel lists and only turned into
+                # request documents here
+                (batch_ids, batch_texts, batch_sources, batch_hashes), embeddings, error = item
+                try:
+                    if error is not None:
+                        raise error
+                    _insert_batch(batch_ids, batch_texts, batch_sources, embeddings)
+                    processing_metrics["inserted_chunks"] += len(batch_ids)
+                    logger.info("Inserted batch of %d chunks (%d so far)",
+                                len(batch_ids), processing_metrics["inserted_chunks"])
+                    # Only remember chunks once they are actually stored
+                    if hash_db is not None:
+                        hash_db.executemany(
+                            "INSERT OR IGNORE INTO chunk_hashes VALUES (?, ?)",
+                            [(vector_db_name, chunk_hash) for chunk_hash in batch_hashes],
+                        )
+                        hash_db.commit()
+                except Exception as e:
+                    logger.error("Embedding insert failed for a batch of %d chunks: %s", len(batch_ids), e)
+                    processing_metrics["failed_batches"] += 1
+                    if pg_conn is not None:
+                        try:
+                            pg_conn.rollback()
+                        except Exception as rollback_error:
+                            # A lost connection cannot be rolled back either,
+                            # the following batches will report their own
+                            # failures
+                            logger.error("Rolling back the failed batch failed: %s", rollback_error)
+
+        ids = []
+        texts = []
+        sources = []
+        hashes = []
+        seen_hashes = set(stored_hashes)
+        processing_metrics["new_chunks"] = 0
+        processing_metrics["duplicate_chunks"] = 0
+
+        def _flush(limit):
+            while len(ids) >= limit and ids:
+                _put(insert_queue, (
+                    ids[:insert_batch_size],
+                    texts[:insert_batch_size],
+                    sources[:insert_batch_size],
+                    hashes[:insert_batch_size],
+                ), embed_thread)
+                del ids[:insert_batch_size], texts[:insert_batch_size]
+                del sources[:insert_batch_size], hashes[:insert_batch_size]
+
+        documents = [None] * len(objects_to_fetch)
+        local_files = {}
+        document_chunk_ids = {}
+        processing_metrics["skipped_files"] = 0
+        chunk_texts = {}
+        next_shard = {}
+        new_chunk_counts = {}
+        failed = set()
+
+        def _remove_local_files(doc_index):
+            # Spooled files are deleted as soon as their document is done, so
+            # the disk only holds the documents that are still in flight
+            for path in local_files.pop(doc_index, ()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        def _emit(doc_index):
+            # A shard is deduplicated and queued for insertion as soon as all
+            # shards before it are chunked, so a long document streams into
+            # the inserts in page order instead of waiting for its last
+            # shard, and only shards that finished out of order are held
+            document = documents[doc_index]
+            shards = chunk_texts[doc_index]
+            chunk_ids = document_chunk_ids.setdefault(doc_index, [])
+            while next_shard[doc_index] < len(shards) and shards[next_shard[doc_index]] is not None:
+                shard_texts = shards[next_shard[doc_index]]
+                shards[next_shard[doc_index]] = None
+                next_shard[doc_index] += 1
+                for text in shard_texts:
+                    chunk_hash = hashlib.sha256(text.encode()).hexdigest()
+                    chunk_ids.append(f"doc-{chunk_hash[:32]}")
+                    if chunk_hash in seen_hashes:
+                        processing_metrics["duplicate_chunks"] += 1
+                        continue
+                    seen_hashes.add(chunk_hash)
+                    new_chunk_counts[doc_index] += 1
+                    processing_metrics["new_chunks"] += 1
+                    # Ids come from the content: sequential ones would let a
+                    # later run overwrite earlier, skipped chunks
+                    ids.append(f"doc-{chunk_hash[:32]}")
+                    texts.append(text)
+                    sources.append(document["name"])
+                    hashes.append(chunk_hash)
+                _flush(insert_batch_size)
+            if next_shard[doc_index] == len(shards):
+                del chunk_texts[doc_index]
+                _remove_local_files(doc_index)
+                logger.info("Created %d chunks from %s", new_chunk_counts.pop(doc_index), document["name"])
+
+        def _collect(future, doc_index, shard_index):
+            if doc_index in failed:
+                return
+            try:
+                chunk_texts[doc_index][shard_index] = future.result()
+                _emit(doc_index)
+
+            except Exception as e:
+                error_message = str(e)
+                logger.error("Error processing %s: %s", documents[doc_index]["name"], error_message)
+                failed.add(doc_index)
+                chunk_texts.pop(doc_index, None)
+                _remove_local_files(doc_index)
+                # Shards queued before the failure stay inserted, but the
+                # file is not recorded as ingested so the next run retries it
+                document_chunk_ids.pop(doc_index, None)
+                processing_metrics["failed_documents"].append(documents[doc_index]["name"])
+
+        logger.info("Processing %d files with docling using %d workers...", len(objects_to_fetch), workers)
+        # The chunker and its tokenizer are loaded once here and inherited by
+        # the forked workers, instead of every worker loading its own copy
+        _get_chunker()
+        # With pin_workers every worker is bound to its own slice of the
+        # allowed CPUs, so the scheduler does not move it (and its warm
+        # caches) between cores. Workers take their slot from a shared
+        # counter as they start.
+        worker_slots = multiprocessing.get_context("fork").Value("i", 0)
+
+        def _init_worker():
+            if pin_workers and hasattr(os, "sched_setaffinity"):
+                with worker_slots.get_lock():
+                    slot = worker_slots.value
+                    worker_slots.value += 1
+                allowed = sorted(os.sched_getaffinity(0))
+                start = slot * threads_per_worker
+                os.sched_setaffinity(0, {
+                    allowed[(start + i) % len(allowed)] for i in range(threads_per_worker)
+                })
+            _get_converter(do_ocr)
+
+        # Workers are forked so they can see the functions defined above
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+        ) as pool:
+            # Start every worker before the download and insert threads exist,
+            # forking a process that has running threads can deadlock the child
+            wait([pool.submit(os.getpid) for _ in range(workers)])
+            threading.Thread(target=_download_all, daemon=True).start()
+            embed_thread = threading.Thread(target=_embed_all, daemon=True)
+            insert_thread = threading.Thread(target=_insert_all, daemon=True)
+            embed_thread.start()
+            insert_thread.start()
+
+            pending = {}
+            while (item := download_queue.get()) is not None:
+                doc_index, document = item
+                download_slots.release()
+                # Only what the summary and the file manifest need is kept for
+                # the whole run, the content only lives as long as its
+                # conversions
+                documents[doc_index] = {"name": document["name"], "sha256": document["sha256"]}
+                if document["sha256"] in stored_files:
+                    logger.info("Skipping %s, unchanged since it was last ingested", document["name"])
+                    processing_metrics["skipped_files"] += 1
+                    if "file_path" in document:
+                        os.remove(document["file_path"])
+                    continue
+                document_shards = _shard(document)
+                local_files[doc_index] = list(dict.fromkeys(
+                    part["file_path"] for part in (document, *document_shards) if "file_path" in part
+                ))
+                chunk_texts[doc_index] = [None] * len(document_shards)
+                next_shard[doc_index] = 0
+                new_chunk_counts[doc_index] = 0
+                for shard_index, shard in enumerate(document_shards):
+                    pending[pool.submit(_convert_and_chunk, shard)] = (doc_index, shard_index)
+
+                # Keep a bounded number of conversions in flight; while this
+                # waits no download slots are given back, which holds the
+                # downloaders back
+                while len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _collect(future, *pending.pop(future))
+
+            for future in as_completed(pending):
+                _collect(future, *pending[future])
+
+        if cache_dir:
+            _trim_document_cache()
+
+        # Send the last partial batch and wait for the inserts to finish, the
+        # embedding thread passes the end marker on once it is done
+        _flush(1)
+        _put(insert_queue, None, embed_thread)
+        insert_thread.join()
+
+        if hash_db is not None:
+            # Files are only recorded once all of their chunks are stored
+            if not processing_metrics["failed_batches"]:
+                hash_db.executemany(
+                    "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?)",
+                    [
+                        (vector_db_name, documents[doc_index]["sha256"], json.dumps(chunk_ids))
+                        for doc_index, chunk_ids in document_chunk_ids.items()
+                    ],
+                )
+                hash_db.commit()
+
+        documents_downloaded = sum(document is not None for document in documents)
+        logger.info("Downloaded %d files", documents_downloaded)
+        if not documents_downloaded:
+            raise Exception(f"No files could be downloaded from bucket: {bucket_name}.")
+
+        if processing_metrics["failed_documents"]:
+            logger.warning("Failed to process %d files: %s",
+                           len(processing_metrics["failed_documents"]), processing_metrics["failed_documents"])
+
+        logger.info("Total valid chunks prepared: %d", processing_metrics["new_chunks"])
+        logger.info("Skipped %d chunks already in the vector DB", processing_metrics["duplicate_chunks"])
+        if processing_metrics["skipped_files"]:
+            logger.info("Skipped %d unchanged files", processing_metrics["skipped_files"])
+
+        # The run summary is also recorded as KFP metrics, so it shows up in
+        # the run details and can be compared between runs
+        metrics.log_metric("downloaded_files", documents_downloaded)
+        metrics.log_metric("skipped_files", processing_metrics["skipped_files"])
+        metrics.log_metric("failed_files", len(processing_metrics["failed_documents"]))
+        metrics.log_metric("new_chunks", processing_metrics["new_chunks"])
+        metrics.log_metric("duplicate_chunks", processing_metrics["duplicate_chunks"])
+        metrics.log_metric("inserted_chunks", processing_metrics["inserted_chunks"])
+        metrics.log_metric("failed_batches", processing_metrics["failed_batches"])
+        metrics.log_metric("embed_fallbacks", processing_metrics["embed_fallbacks"])
+
+        # Add error handling for zero chunks
+        if processing_metrics["new_chunks"] == 0:
+            if processing_metrics["duplicate_chunks"] or processing_metrics["skipped_files"]:
+                logger.info("All chunks are already in the vector DB, nothing to insert")
+                return
+            raise Exception("No valid chunks were created. Check document processing errors above.")
+
+        if processing_metrics["failed_batches"]:
+            raise Exception(
+                f"Failed to insert {processing_metrics['failed_batches']} batches into vector DB, see errors above"
+            )
+        logger.info("Documents successfully inserted into the vector DB")
 
     finally:
+        if http_client is not None:
+            http_client.close()
+        if pg_conn is not None:
+            pg_conn.close()
+        if hash_db is not None:
+            hash_db.close()
         shutil.rmtree(temp_dir, ignore_errors=True)
-        print(f"Cleaned up temporary directory: {temp_dir}")
+        logger.info("Cleaned up temporary directory: %s", temp_dir)
+        log_listener.stop()
 
 @dsl.pipeline(name="fetch-and-store-pipeline")
-def full_pipeline():
+def full_pipeline(
+    local_embed: bool = False,
+    fast_load: bool = False,
+    pgvector_write_mode: str = "copy",
+    do_ocr: bool = False,
+    pin_workers: bool = False,
+    fast_text_extraction: bool = False,
+):
   import os
   from kfp import kubernetes
   secret_key_to_env = {
@@ -187,11 +1207,41 @@ def full_pipeline():
           'SECRET_ACCESS_KEY': 'SECRET_ACCESS_KEY',
           'ENDPOINT_URL': 'ENDPOINT_URL',
           'BUCKET_NAME': 'BUCKET_NAME',
-          'REGION': 'REGION'
+          'REGION': 'REGION',
+          'PGVECTOR_DSN': 'PGVECTOR_DSN'
   }
 
+  # The ingestion caches only help re-runs when they live on a volume,
+  # the pod's own filesystem is gone once the step finishes
+  cache_pvc = os.environ.get("INGESTION_CACHE_PVC", "")
+
   fetch_task = fetch_from_minio_store_pgvector(
-      llamastack_base_url=os.environ["LLAMASTACK_BASE_URL"])
+      llamastack_base_url=os.environ["LLAMASTACK_BASE_URL"],
+      cache_dir="/ingestion-cache" if cache_pvc else "",
+      document_cache_mb=int(os.environ.get("INGESTION_DOCUMENT_CACHE_MB", "8192")),
+      local_embed=local_embed,
+      fast_load=fast_load,
+      pgvector_write_mode=pgvector_write_mode,
+      do_ocr=do_ocr,
+      pin_workers=pin_workers,
+      fast_text_extraction=fast_text_extraction)
+
+  if cache_pvc:
+      kubernetes.mount_pvc(fetch_task, pvc_name=cache_pvc, mount_path="/ingestion-cache")
+
+  # The worker pool is sized from the pod's CPU quota, without a limit it
+  # would be sized to the whole node. The requests are set explicitly and
+  # kept small, otherwise Kubernetes requests the full limits and the pod
+  # may not fit on a small cluster. Empty values leave a setting out
+  resources = {
+      fetch_task.set_cpu_request: os.environ.get("INGESTION_CPU_REQUEST", "1"),
+      fetch_task.set_cpu_limit: os.environ.get("INGESTION_CPU_LIMIT", "4"),
+      fetch_task.set_memory_request: os.environ.get("INGESTION_MEMORY_REQUEST", "2Gi"),
+      fetch_task.set_memory_limit: os.environ.get("INGESTION_MEMORY_LIMIT", "16Gi"),
+  }
+  for set_resource, value in resources.items():
+      if value:
+          set_resource(value)
 
   kubernetes.use_secret_as_env(
       task=fetch_task,
@@ -220,9 +1270,20 @@ uploaded_pipeline = client.upload_pipeline(
 )
 
 # 4. Run the pipeline
+# The run options come from the chart's values through the job's environment
+def env_flag(name):
+  return os.environ.get(name, "false").lower() == "true"
+
 run = client.create_run_from_pipeline_package(
   pipeline_file=pipeline_yaml,
-  arguments={},
+  arguments={
+      "local_embed": env_flag("LOCAL_EMBED"),
+      "fast_load": env_flag("FAST_LOAD"),
+      "pgvector_write_mode": os.environ.get("PGVECTOR_WRITE_MODE", "copy"),
+      "do_ocr": env_flag("DO_OCR"),
+      "pin_workers": env_flag("PIN_WORKERS"),
+      "fast_text_extraction": env_flag("FAST_TEXT_EXTRACTION"),
+  },
   run_name="fetch-store-run"
 )
 